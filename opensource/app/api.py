@@ -2,24 +2,73 @@ import csv
 import io
 import json
 import logging
-import os
 import re
-from typing import Any, Dict, List
+from functools import lru_cache
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
 
 import httpx
 from fastapi import APIRouter, HTTPException, Query, Request
 
+from .ba import _get_influx_config
+
 router = APIRouter(prefix="/api")
 logger = logging.getLogger("uvicorn.error")
 _BUCKET_RE = re.compile(r"^\d+[smhd]$")
+_BUCKET_MATCH = _BUCKET_RE.match
+
+# Flux skeletons for the dashboard endpoints; only the lookback window, the
+# site filter and the per-endpoint knobs are interpolated per request.
+_SUMMARY_QUERY = (
+    "{source}"
+    "  |> range(start: -{hours}h)\n"
+    '  |> filter(fn: (r) => r._measurement == "logflow" and r._field == "count")\n'
+    '  |> filter(fn: (r) => (not exists r.t) or r.t != "heartbeat")\n'
+    "{site_filter}"
+    "  |> group(columns: [])\n"
+    "  |> sum()\n"
+)
+_TOP_ROUTES_QUERY = (
+    "{source}"
+    "  |> range(start: -{hours}h)\n"
+    '  |> filter(fn: (r) => r._measurement == "logflow" and r._field == "count")\n'
+    '  |> filter(fn: (r) => exists r.t and r.t == "page")\n'
+    "{site_filter}"
+    '  |> group(columns: ["route"])\n'
+    '  |> sum(column: "_value")\n'
+    '  |> sort(columns: ["_value"], desc: true)\n'
+    "  |> limit(n: {limit})\n"
+)
+_SERIES_QUERY = (
+    "{source}"
+    "  |> range(start: -{hours}h)\n"
+    '  |> filter(fn: (r) => r._measurement == "logflow" and r._field == "count")\n'
+    '  |> filter(fn: (r) => (not exists r.t) or r.t != "heartbeat")\n'
+    "{site_filter}"
+    "  |> aggregateWindow(every: {bucket}, fn: sum, createEmpty: false)\n"
+    "  |> group(columns: [])\n"
+)
+_EVENTS_QUERY = (
+    "{source}"
+    "  |> range(start: -{hours}h)\n"
+    '  |> filter(fn: (r) => r._measurement == "logflow" and r._field == "payload")\n'
+    '  |> filter(fn: (r) => (not exists r.t) or r.t != "heartbeat")\n'
+    "{site_filter}"
+    '  |> sort(columns: ["_time"], desc: true)\n'
+    "  |> limit(n: {limit})\n"
+)
+
 
+@lru_cache(maxsize=1)
+def _query_params() -> Dict[str, str]:
+    return {"org": _get_influx_config()["org"]}
 
-def _get_influx_config() -> Dict[str, str]:
+
+@lru_cache(maxsize=1)
+def _query_headers() -> Dict[str, str]:
     return {
-        "url": os.getenv("INFLUX_URL", "http://influxdb:8086").rstrip("/"),
-        "token": os.getenv("INFLUX_TOKEN", "logflow-dev-token"),
-        "org": os.getenv("INFLUX_ORG", "logflow"),
-        "bucket": os.getenv("INFLUX_BUCKET", "logflow"),
+        "Authorization": f"Token {_get_influx_config()['token']}",
+        "Content-Type": "application/vnd.flux",
+        "Accept": "application/csv",
     }
 
 
@@ -27,6 +76,12 @@ def _escape_flux(value: str) -> str:
     return value.replace("\\", "\\\\").replace('"', '\\"')
 
 
+@lru_cache(maxsize=1)
+def _bucket_source() -> str:
+    return f'from(bucket: "{_escape_flux(_get_influx_config()["bucket"])}")\n'
+
+
+@lru_cache(maxsize=128)
 def _site_filter(site: str | None) -> str:
     if not site:
         return ""
@@ -34,52 +89,118 @@ def _site_filter(site: str | None) -> str:
     return f'  |> filter(fn: (r) => r["site"] == "{escaped}")\n'
 
 
-def _parse_flux_csv(text: str) -> List[Dict[str, str]]:
-    rows: List[Dict[str, str]] = []
-    reader = csv.reader(io.StringIO(text))
-    header: List[str] = []
-    for row in reader:
-        if not row:
-            continue
-        first = row[0]
-        if first.startswith("#"):
-            continue
-        if first == "result" and len(row) > 1 and row[1] == "table":
-            header = row
-            continue
-        if not header:
-            header = row
-            continue
-        if len(row) != len(header):
-            continue
-        rows.append(dict(zip(header, row)))
-    return rows
+def _to_int(value: Any) -> int:
+    # Flux sums come back as plain digit strings; skip the float round-trip.
+    if isinstance(value, str) and value.isdigit():
+        return int(value)
+    return int(float(value))
 
 
-async def _query_flux(request: Request, query: str) -> List[Dict[str, str]]:
-    cfg = _get_influx_config()
-    headers = {
-        "Authorization": f"Token {cfg['token']}",
-        "Content-Type": "application/vnd.flux",
-        "Accept": "application/csv",
-    }
-    client: httpx.AsyncClient | None = getattr(request.app.state, "http_client", None)
+def _is_flux_header(row: List[str]) -> bool:
+    if row[0] == "result":
+        return len(row) > 1 and row[1] == "table"
+    return not row[0] and len(row) > 2 and row[1] == "result" and row[2] == "table"
+
+
+class _FluxCsvDecoder:
+    """Incremental decoder for Influx CSV responses.
+
+    Header state is kept between ``decode`` calls so a response can be fed in
+    chunks (each ending on a record boundary) while it streams in. When
+    ``columns`` is given only those columns are kept, which avoids
+    materializing the full (often wide) row for callers that read one or two
+    values.
+    """
+
+    def __init__(self, columns: Optional[Sequence[str]] = None) -> None:
+        self.columns = columns
+        self.header: List[str] = []
+        self.picks: List[Tuple[str, int]] = []
+        self.width = 0
+        self.expect_header = True
+
+    def decode(self, text: str) -> List[Dict[str, str]]:
+        rows: List[Dict[str, str]] = []
+        columns = self.columns
+        for row in csv.reader(io.StringIO(text)):
+            if not row:
+                # Tables are separated by a blank line and each starts with its own header.
+                self.expect_header = True
+                continue
+            if row[0].startswith("#"):
+                continue
+            if self.expect_header or _is_flux_header(row):
+                self.header = row
+                self.width = len(row)
+                if columns is not None:
+                    self.picks = [(name, row.index(name)) for name in columns if name in row]
+                self.expect_header = False
+                continue
+            if len(row) != self.width:
+                continue
+            if columns is None:
+                rows.append(dict(zip(self.header, row)))
+            else:
+                rows.append({name: row[idx] for name, idx in self.picks})
+        return rows
+
+
+def _parse_flux_csv(text: str, columns: Optional[Sequence[str]] = None) -> List[Dict[str, str]]:
+    return _FluxCsvDecoder(columns).decode(text)
+
+
+async def _stream_flux(
+    request: Request, query: str, columns: Optional[Sequence[str]] = None
+) -> AsyncIterator[Dict[str, str]]:
+    """Yield Flux result rows as the response streams in.
+
+    Aggregating callers consume rows incrementally instead of buffering the
+    whole body and a full list of row dicts first.
+    """
+    client: httpx.AsyncClient = request.app.state.http_client
+    decoder = _FluxCsvDecoder(columns)
     try:
-        if client is None:
-            async with httpx.AsyncClient(timeout=httpx.Timeout(10.0, connect=3.0)) as temp_client:
-                response = await temp_client.post(
-                    f"{cfg['url']}/api/v2/query",
-                    params={"org": cfg["org"]},
-                    headers=headers,
-                    content=query.encode("utf-8"),
-                )
-        else:
-            response = await client.post(
-                f"{cfg['url']}/api/v2/query",
-                params={"org": cfg["org"]},
-                headers=headers,
-                content=query.encode("utf-8"),
-            )
+        async with client.stream(
+            "POST",
+            _get_influx_config()["query_url"],
+            params=_query_params(),
+            headers=_query_headers(),
+            content=query.encode("utf-8"),
+        ) as response:
+            if response.status_code >= 400:
+                await response.aread()
+                logger.warning("Influx query error %s: %s", response.status_code, response.text)
+                raise HTTPException(status_code=502, detail="Influx query rejected")
+            pending = ""
+            async for chunk in response.aiter_text():
+                pending += chunk
+                cut = pending.rfind("\n") + 1
+                # Only hand complete records to the decoder: stop at the last
+                # newline that is not inside a quoted field.
+                if not cut or pending.count('"', 0, cut) % 2:
+                    continue
+                for row in decoder.decode(pending[:cut]):
+                    yield row
+                pending = pending[cut:]
+            if pending:
+                for row in decoder.decode(pending):
+                    yield row
+    except httpx.HTTPError as exc:
+        logger.warning("Influx query request failed: %s", exc)
+        raise HTTPException(status_code=502, detail="Influx query failed") from exc
+
+
+async def _query_flux(
+    request: Request, query: str, columns: Optional[Sequence[str]] = None
+) -> List[Dict[str, str]]:
+    client: httpx.AsyncClient = request.app.state.http_client
+    try:
+        response = await client.post(
+            _get_influx_config()["query_url"],
+            params=_query_params(),
+            headers=_query_headers(),
+            content=query.encode("utf-8"),
+        )
     except Exception as exc:  # pragma: no cover - defensive
         logger.warning("Influx query request failed: %s", exc)
         raise HTTPException(status_code=502, detail="Influx query failed") from exc
@@ -88,7 +209,7 @@ async def _query_flux(request: Request, query: str) -> List[Dict[str, str]]:
         logger.warning("Influx query error %s: %s", response.status_code, response.text)
         raise HTTPException(status_code=502, detail="Influx query rejected")
 
-    return _parse_flux_csv(response.text)
+    return _parse_flux_csv(response.text, columns)
 
 
 @router.get("/summary")
@@ -97,24 +218,14 @@ async def summary(
     hours: int = Query(24, ge=1, le=168),
     site: str | None = Query(None),
 ) -> Dict[str, Any]:
-    cfg = _get_influx_config()
-    query = (
-        f'from(bucket: "{_escape_flux(cfg["bucket"])}")\n'
-        f"  |> range(start: -{hours}h)\n"
-        '  |> filter(fn: (r) => r._measurement == "logflow" and r._field == "count")\n'
-        '  |> filter(fn: (r) => (not exists r.t) or r.t != "heartbeat")\n'
-        f"{_site_filter(site)}"
-        "  |> group(columns: [])\n"
-        "  |> sum()\n"
-    )
-    rows = await _query_flux(request, query)
+    query = _SUMMARY_QUERY.format(source=_bucket_source(), hours=hours, site_filter=_site_filter(site))
     total = 0
-    for row in rows:
+    async for row in _stream_flux(request, query, ("_value",)):
         value = row.get("_value")
         if value is None:
             continue
         try:
-            total += int(float(value))
+            total += _to_int(value)
         except ValueError:
             continue
     return {"site": site, "hours": hours, "count": total}
@@ -127,27 +238,17 @@ async def top_routes(
     limit: int = Query(10, ge=1, le=50),
     site: str | None = Query(None),
 ) -> Dict[str, Any]:
-    cfg = _get_influx_config()
-    query = (
-        f'from(bucket: "{_escape_flux(cfg["bucket"])}")\n'
-        f"  |> range(start: -{hours}h)\n"
-        '  |> filter(fn: (r) => r._measurement == "logflow" and r._field == "count")\n'
-        '  |> filter(fn: (r) => exists r.t and r.t == "page")\n'
-        f"{_site_filter(site)}"
-        '  |> group(columns: ["route"])\n'
-        '  |> sum(column: "_value")\n'
-        '  |> sort(columns: ["_value"], desc: true)\n'
-        f"  |> limit(n: {limit})\n"
+    query = _TOP_ROUTES_QUERY.format(
+        source=_bucket_source(), hours=hours, site_filter=_site_filter(site), limit=limit
     )
-    rows = await _query_flux(request, query)
     totals: Dict[str, int] = {}
-    for row in rows:
+    async for row in _stream_flux(request, query, ("route", "_value")):
         route = row.get("route")
         value = row.get("_value")
         if not route or value is None:
             continue
         try:
-            totals[route] = totals.get(route, 0) + int(float(value))
+            totals[route] = totals.get(route, 0) + _to_int(value)
         except ValueError:
             continue
     sorted_routes = sorted(totals.items(), key=lambda item: item[1], reverse=True)[:limit]
@@ -166,30 +267,22 @@ async def series(
     bucket: str = Query("5m"),
     site: str | None = Query(None),
 ) -> Dict[str, Any]:
-    if not _BUCKET_RE.match(bucket):
+    if not _BUCKET_MATCH(bucket):
         raise HTTPException(status_code=400, detail="Invalid bucket size")
-    cfg = _get_influx_config()
-    query = (
-        f'from(bucket: "{_escape_flux(cfg["bucket"])}")\n'
-        f"  |> range(start: -{hours}h)\n"
-        '  |> filter(fn: (r) => r._measurement == "logflow" and r._field == "count")\n'
-        '  |> filter(fn: (r) => (not exists r.t) or r.t != "heartbeat")\n'
-        f"{_site_filter(site)}"
-        f"  |> aggregateWindow(every: {bucket}, fn: sum, createEmpty: false)\n"
-        "  |> group(columns: [])\n"
+    query = _SERIES_QUERY.format(
+        source=_bucket_source(), hours=hours, site_filter=_site_filter(site), bucket=bucket
     )
-    rows = await _query_flux(request, query)
     points: List[Dict[str, Any]] = []
-    for row in rows:
+    async for row in _stream_flux(request, query, ("_time", "_value")):
         ts = row.get("_time")
         value = row.get("_value")
         if ts is None or value is None:
             continue
         try:
-            count = int(float(value))
+            count = _to_int(value)
         except ValueError:
             continue
-    points.append({"ts": ts, "count": count})
+        points.append({"ts": ts, "count": count})
     points.sort(key=lambda item: item["ts"])
     return {"site": site, "hours": hours, "bucket": bucket, "points": points}
 
@@ -201,17 +294,10 @@ async def recent_events(
     limit: int = Query(20, ge=1, le=200),
     site: str | None = Query(None),
 ) -> Dict[str, Any]:
-    cfg = _get_influx_config()
-    query = (
-        f'from(bucket: "{_escape_flux(cfg["bucket"])}")\n'
-        f"  |> range(start: -{hours}h)\n"
-        '  |> filter(fn: (r) => r._measurement == "logflow" and r._field == "payload")\n'
-        '  |> filter(fn: (r) => (not exists r.t) or r.t != "heartbeat")\n'
-        f"{_site_filter(site)}"
-        '  |> sort(columns: ["_time"], desc: true)\n'
-        f"  |> limit(n: {limit})\n"
+    query = _EVENTS_QUERY.format(
+        source=_bucket_source(), hours=hours, site_filter=_site_filter(site), limit=limit
     )
-    rows = await _query_flux(request, query)
+    rows = await _query_flux(request, query, ("_time", "_value", "t", "route"))
     events: List[Dict[str, Any]] = []
     for row in rows:
         raw = row.get("_value") or ""
@@ -1,65 +1,148 @@
-import json
+import asyncio
 import logging
+import math
 import os
 import re
 import time
-from typing import Any, Dict
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Optional, Tuple
 
 import httpx
-from fastapi import APIRouter, Request, Response
+import orjson
+from fastapi import APIRouter, FastAPI, Request, Response
 
 router = APIRouter()
 logger = logging.getLogger("uvicorn.error")
 
-SEGMENT_RE = re.compile(r"/([0-9]+|[0-9a-fA-F]{12,})")
+WRITE_BATCH_SIZE = max(1, int(os.getenv("INFLUX_WRITE_BATCH_SIZE", "500")))
+WRITE_FLUSH_INTERVAL = max(0.0, float(os.getenv("INFLUX_WRITE_FLUSH_MS", "250")) / 1000.0)
+WRITE_QUEUE_MAX = max(1, int(os.getenv("INFLUX_WRITE_QUEUE_MAX", "10000")))
+# The recent-events feed (/api/events) is rendered from the `payload` field;
+# disable only when the dashboard feed is not needed.
+INCLUDE_PAYLOAD = os.getenv("INFLUX_INCLUDE_RAW_PAYLOAD", "1").strip().lower() not in ("0", "false", "no")
 
+# Read-only stand-in for missing/invalid nested objects in the event body.
+_EMPTY: Mapping[str, Any] = MappingProxyType({})
+# Event keys that carry pointer geometry (clicks); other events skip parsing it.
+_POINTER_KEYS = frozenset(("coords", "doc_x", "doc_y", "doc_w", "doc_h"))
 
-def _get_influx_config() -> Dict[str, str]:
-    return {
-        "url": os.getenv("INFLUX_URL", "http://influxdb:8086").rstrip("/"),
+SEGMENT_RE = re.compile(r"/([0-9]+|[0-9a-fA-F]{12,})")
+_SEGMENT_SUB = SEGMENT_RE.sub
+_isfinite = math.isfinite
+# Longest string the lru caches below will hold as a key.
+_MEMO_MAX_LEN = 256
+_LINE_BREAKS = str.maketrans({"\r": " ", "\n": " "})
+
+
+@lru_cache(maxsize=1)
+def _get_influx_config() -> Mapping[str, str]:
+    # Environment is fixed for the lifetime of the process; call
+    # `_get_influx_config.cache_clear()` to pick up changes (e.g. in tests).
+    # The mapping is shared by every caller, so it is handed out read-only.
+    url = os.getenv("INFLUX_URL", "http://influxdb:8086").rstrip("/")
+    return MappingProxyType({
+        "url": url,
         "token": os.getenv("INFLUX_TOKEN", "logflow-dev-token"),
         "org": os.getenv("INFLUX_ORG", "logflow"),
         "bucket": os.getenv("INFLUX_BUCKET", "logflow"),
+        "write_url": f"{url}/api/v2/write",
+        "query_url": f"{url}/api/v2/query",
+    })
+
+
+@lru_cache(maxsize=1)
+def _write_request_parts() -> Tuple[Dict[str, str], Dict[str, str]]:
+    cfg = _get_influx_config()
+    params = {"org": cfg["org"], "bucket": cfg["bucket"], "precision": "ms"}
+    headers = {
+        "Authorization": f"Token {cfg['token']}",
+        "Content-Type": "text/plain; charset=utf-8",
     }
+    return params, headers
 
 
 def _normalize_route(raw: Any) -> str:
     if not raw:
         return "/"
-    path = str(raw).split("?", 1)[0]
+    text = raw if isinstance(raw, str) else str(raw)
+    # Only short values are memoized: the cache bounds entries, not their
+    # size, and /ba accepts arbitrarily long strings.
+    if len(text) > _MEMO_MAX_LEN:
+        return _normalize_route_str(text)
+    return _normalize_route_cached(text)
+
+
+def _normalize_route_str(raw: str) -> str:
+    path = raw.split("?", 1)[0]
     if not path.startswith("/"):
         path = "/" + path
-    path = SEGMENT_RE.sub("/:id", path)
+    path = _SEGMENT_SUB("/:id", path)
     if len(path) > 1 and path.endswith("/"):
         path = path.rstrip("/")
     return path or "/"
 
 
+# Real traffic repeats a small set of paths, so memoizing collapses the
+# split/regex/strip work to a dict hit on the ingest hot path.
+_normalize_route_cached = lru_cache(maxsize=4096)(_normalize_route_str)
+
+
 def _escape_tag(value: Any) -> str:
-    text = str(value)
+    # Tag values (site, type, route, snapshot, ...) repeat heavily, so short
+    # ones are memoized. Long values are escaped directly: maxsize bounds the
+    # entry count, not the size of each key.
+    if isinstance(value, str) and len(value) > _MEMO_MAX_LEN:
+        return _escape_tag_text(value)
+    return _escape_tag_cached(value)
+
+
+def _escape_tag_text(value: Any) -> str:
+    # Line protocol has no escape for CR/LF; a raw newline would end the line
+    # and smuggle extra points into the shared write batch.
+    text = str(value).translate(_LINE_BREAKS)
     text = text.replace("\\", "\\\\")
     text = text.replace(",", "\\,").replace(" ", "\\ ").replace("=", "\\=")
     return text
 
 
+_escape_tag_cached = lru_cache(maxsize=8192)(_escape_tag_text)
+
+
 def _escape_field(value: Any) -> str:
-    text = str(value)
+    text = str(value).translate(_LINE_BREAKS)
     text = text.replace("\\", "\\\\")
     return text.replace('"', '\\"')
 
 
 def _coerce_int(value: Any, default: int = 0) -> int:
+    # Dispatch on the JSON-decoded type first: missing fields (None) are the
+    # common case and would otherwise pay for a raised TypeError.
+    if type(value) is int:
+        return value
+    if value is None:
+        return default
+    if type(value) is float:
+        return int(value) if _isfinite(value) else default
     try:
+        if isinstance(value, str) and value.isdigit():
+            return int(value)
         return int(float(value))
-    except (TypeError, ValueError):
+    except (TypeError, ValueError, OverflowError):
         return default
 
 
 def _coerce_float(value: Any, default: float = 0.0) -> float:
+    # Influx rejects nan/inf field values, which would fail the whole batch.
+    if type(value) is float:
+        return value if _isfinite(value) else default
+    if value is None:
+        return default
     try:
-        return float(value)
-    except (TypeError, ValueError):
+        result = float(value)
+    except (TypeError, ValueError, OverflowError):
         return default
+    return result if _isfinite(result) else default
 
 
 def _format_float(value: float, precision: int = 6) -> str:
@@ -68,47 +151,107 @@ def _format_float(value: float, precision: int = 6) -> str:
     return text or "0"
 
 
-async def _write_line(request: Request, line: str, cfg: Dict[str, str]) -> None:
-    params = {"org": cfg["org"], "bucket": cfg["bucket"], "precision": "ms"}
-    headers = {
-        "Authorization": f"Token {cfg['token']}",
-        "Content-Type": "text/plain; charset=utf-8",
-    }
-    client: httpx.AsyncClient | None = getattr(request.app.state, "http_client", None)
-    if client is not None:
+@lru_cache(maxsize=256)
+def _format_dpr(value: float) -> str:
+    # Devices report a handful of distinct ratios, so this is nearly always a hit.
+    return _format_float(value, 3)
+
+
+async def _post_lines(app: FastAPI, lines: List[bytes]) -> Optional[httpx.Response]:
+    cfg = _get_influx_config()
+    params, headers = _write_request_parts()
+    client: httpx.AsyncClient = app.state.http_client
+    try:
+        return await client.post(
+            cfg["write_url"],
+            params=params,
+            content=b"\n".join(lines),
+            headers=headers,
+        )
+    except Exception as exc:
+        logger.warning("Failed to write %d analytics events to Influx: %s", len(lines), exc)
+        return None
+
+
+async def _write_lines(app: FastAPI, lines: List[bytes]) -> None:
+    response = await _post_lines(app, lines)
+    if response is None or response.status_code < 400:
+        return
+    logger.warning("Influx write rejected (%s): %s", response.status_code, response.text)
+    if response.status_code != 400 or len(lines) == 1:
+        return
+    # A single unparsable point fails the whole body; resend line by line so
+    # the valid events in the batch are kept. Identical points overwrite, so
+    # anything Influx already accepted is not double counted.
+    for line in lines:
+        response = await _post_lines(app, [line])
+        if response is not None and response.status_code >= 400:
+            logger.warning("Influx write rejected (%s): %s", response.status_code, response.text)
+
+
+def _drain_queue(queue: "asyncio.Queue[bytes]", batch: List[bytes], limit: Optional[int]) -> None:
+    while limit is None or len(batch) < limit:
         try:
-            await client.post(
-                f"{cfg['url']}/api/v2/write",
-                params=params,
-                content=line,
-                headers=headers,
-            )
+            batch.append(queue.get_nowait())
+        except asyncio.QueueEmpty:
             return
-        except Exception as exc:  # pragma: no cover - defensive
-            logger.debug("Influx write via shared client failed: %s", exc)
-    async with httpx.AsyncClient(timeout=httpx.Timeout(5.0, connect=2.0)) as temp_client:
-        try:
-            await temp_client.post(
-                f"{cfg['url']}/api/v2/write",
-                params=params,
-                content=line,
-                headers=headers,
-            )
-        except Exception as exc:
-            logger.warning("Failed to write analytics event to Influx: %s", exc)
+
+
+def _log_dropped(app: FastAPI) -> None:
+    dropped = app.state.write_dropped
+    if dropped:
+        app.state.write_dropped = 0
+        logger.warning("Influx write queue full; dropped %d analytics events", dropped)
+
+
+async def _run_write_flusher(app: FastAPI) -> None:
+    """Coalesce queued line-protocol records into batched Influx writes.
+
+    Runs for the lifetime of the app. Each batch waits at most
+    WRITE_FLUSH_INTERVAL for more lines (or until WRITE_BATCH_SIZE are
+    queued) and goes out as a single POST. On cancellation everything still
+    queued is flushed before the task exits.
+    """
+    queue: "asyncio.Queue[bytes]" = app.state.write_queue
+    batch: List[bytes] = []
+    try:
+        while True:
+            batch.append(await queue.get())
+            if queue.qsize() < WRITE_BATCH_SIZE:
+                await asyncio.sleep(WRITE_FLUSH_INTERVAL)
+            _drain_queue(queue, batch, WRITE_BATCH_SIZE)
+            await _write_lines(app, batch)
+            batch = []
+            _log_dropped(app)
+    except asyncio.CancelledError:
+        # A batch interrupted mid-POST is re-sent; Influx overwrites identical
+        # points, so the retry cannot double count.
+        _drain_queue(queue, batch, None)
+        for start in range(0, len(batch), WRITE_BATCH_SIZE):
+            await _write_lines(app, batch[start : start + WRITE_BATCH_SIZE])
+        _log_dropped(app)
+        raise
+
+
+def _enqueue_line(request: Request, line: bytes) -> None:
+    try:
+        request.app.state.write_queue.put_nowait(line)
+    except asyncio.QueueFull:
+        # Counted here and reported once per flush: a warning per dropped
+        # event would add logging load exactly when ingest is overloaded.
+        request.app.state.write_dropped += 1
 
 
 @router.post("/ba", status_code=204)
 async def ingest(request: Request) -> Response:
-    cfg = _get_influx_config()
-
     client_host = ""
     if request.client:
         client_host = request.client.host or ""
 
     try:
-        payload = await request.json()
+        payload = orjson.loads(await request.body())
     except Exception:
+        # Malformed bodies (and disconnects) are dropped; /ba always answers 204.
         return Response(status_code=204)
 
     if not isinstance(payload, dict):
@@ -130,33 +273,45 @@ async def ingest(request: Request) -> Response:
     depth = _coerce_int(event.get("depth"), 0)
     sec = _coerce_int(event.get("sec"), 0)
 
-    vp = event.get("vp") if isinstance(event.get("vp"), dict) else {}
-    vp_w = _coerce_int(vp.get("w") if isinstance(vp, dict) else None, 0)
-    vp_h = _coerce_int(vp.get("h") if isinstance(vp, dict) else None, 0)
-    vp_dpr = _coerce_float(vp.get("dpr") if isinstance(vp, dict) else None, 0.0)
+    vp = event.get("vp")
+    if not isinstance(vp, dict):
+        vp = _EMPTY
+    vp_w = _coerce_int(vp.get("w"), 0)
+    vp_h = _coerce_int(vp.get("h"), 0)
+    vp_dpr = _coerce_float(vp.get("dpr"), 0.0)
 
     path_field = event.get("path") or event.get("url") or route
     element = str(event.get("element") or "").strip()
 
-    coords = event.get("coords") if isinstance(event.get("coords"), dict) else {}
-    raw_cx = coords.get("x") if isinstance(coords, dict) else None
-    raw_cy = coords.get("y") if isinstance(coords, dict) else None
-    raw_px = coords.get("pageX") if isinstance(coords, dict) else None
-    raw_py = coords.get("pageY") if isinstance(coords, dict) else None
-    cx = _coerce_int(raw_cx, 0)
-    cy = _coerce_int(raw_cy, 0)
-    page_x = _coerce_int(raw_px, 0)
-    page_y = _coerce_int(raw_py, 0)
-    has_coords = any(value is not None for value in (raw_cx, raw_cy, raw_px, raw_py))
+    if _POINTER_KEYS.isdisjoint(event):
+        # Page/scroll events carry no pointer geometry; skip those coercions.
+        raw_cx = raw_cy = raw_px = raw_py = None
+        cx = cy = page_x = page_y = 0
+        has_coords = False
+        doc_x_value = doc_y_value = -1.0
+        doc_w = doc_h = 0
+    else:
+        coords = event.get("coords")
+        if not isinstance(coords, dict):
+            coords = _EMPTY
+        raw_cx = coords.get("x")
+        raw_cy = coords.get("y")
+        raw_px = coords.get("pageX")
+        raw_py = coords.get("pageY")
+        cx = _coerce_int(raw_cx, 0)
+        cy = _coerce_int(raw_cy, 0)
+        page_x = _coerce_int(raw_px, 0)
+        page_y = _coerce_int(raw_py, 0)
+        has_coords = any(value is not None for value in (raw_cx, raw_cy, raw_px, raw_py))
+        doc_x_value = _coerce_float(event.get("doc_x"), -1.0)
+        doc_y_value = _coerce_float(event.get("doc_y"), -1.0)
+        doc_w = _coerce_int(event.get("doc_w"), 0)
+        doc_h = _coerce_int(event.get("doc_h"), 0)
     section = str(event.get("section") or "").strip()
     element_text = str(event.get("element_text") or "").strip()
     el_hash = str(event.get("el_hash") or "").strip()
     x_bin_value = event.get("x_bin")
     y_bin_value = event.get("y_bin")
-    doc_x_value = _coerce_float(event.get("doc_x"), -1.0)
-    doc_y_value = _coerce_float(event.get("doc_y"), -1.0)
-    doc_w = _coerce_int(event.get("doc_w"), 0)
-    doc_h = _coerce_int(event.get("doc_h"), 0)
     scroll_top = _coerce_int(event.get("scroll_top"), 0) if "scroll_top" in event else None
     scroll_height = _coerce_int(event.get("scroll_height"), 0) if "scroll_height" in event else None
     viewport_height = _coerce_int(event.get("viewport_height"), 0) if "viewport_height" in event else None
@@ -166,154 +321,149 @@ async def ingest(request: Request) -> Response:
     if not grid_id:
         grid_id = "default"
 
-    timestamp_ms = int(time.time() * 1000)
+    timestamp_ms: Optional[int] = None
     for key in ("ts", "timestamp"):
-        if key in event:
+        value = event.get(key)
+        if type(value) is int:
+            timestamp_ms = value
+            break
+        if value is not None:
             try:
-                timestamp_ms = int(float(event[key]))
+                timestamp_ms = int(float(value))
                 break
-            except (TypeError, ValueError):
+            except (TypeError, ValueError, OverflowError):
                 continue
-
-    fields = [
-        "count=1i",
-        f"depth={depth}i",
-        f"sec={sec}i",
-        f"vp_w={vp_w}i",
-        f"vp_h={vp_h}i",
+    if timestamp_ms is None:
+        timestamp_ms = time.time_ns() // 1_000_000
+
+    dpr_str = _format_dpr(vp_dpr) if vp_dpr else "0"
+    # The measurement, tags and always-present fields go out as one f-string;
+    # optional fields carry their own leading comma so a single join yields the
+    # finished line.
+    parts = [
+        f"logflow,site={_escape_tag(site)},t={_escape_tag(event_type)},route={_escape_tag(route)} "
+        f"count=1i,depth={depth}i,sec={sec}i,vp_w={vp_w}i,vp_h={vp_h}i,vp_dpr={dpr_str},"
+        f'path="{_escape_field(path_field)}"'
     ]
-    dpr_str = f"{vp_dpr:.3f}".rstrip("0").rstrip(".") or "0"
-    fields.append(f"vp_dpr={dpr_str}")
-    fields.append(f'path="{_escape_field(path_field)}"')
+    append = parts.append
     if element:
-        fields.append(f'element="{_escape_field(element)}"')
+        append(f',element="{_escape_field(element)}"')
     if has_coords:
-        fields.append(f"cx={cx}i")
-        fields.append(f"cy={cy}i")
+        append(f",cx={cx}i,cy={cy}i")
         if raw_px is not None:
-            fields.append(f"px={page_x}i")
+            append(f",px={page_x}i")
         if raw_py is not None:
-            fields.append(f"py={page_y}i")
+            append(f",py={page_y}i")
     if doc_x_value >= 0:
-        fields.append(f"doc_x={_format_float(doc_x_value)}")
+        append(f",doc_x={_format_float(doc_x_value)}")
     if doc_y_value >= 0:
-        fields.append(f"doc_y={_format_float(doc_y_value)}")
+        append(f",doc_y={_format_float(doc_y_value)}")
     if doc_w > 0:
-        fields.append(f"doc_w={doc_w}i")
+        append(f",doc_w={doc_w}i")
     if doc_h > 0:
-        fields.append(f"doc_h={doc_h}i")
+        append(f",doc_h={doc_h}i")
     if snapshot_hash:
-        fields.append(f'snapshot="{_escape_field(snapshot_hash)}"')
+        append(f',snapshot="{_escape_field(snapshot_hash)}"')
     if vp_bucket:
-        fields.append(f'vp_bucket="{_escape_field(vp_bucket)}"')
+        append(f',vp_bucket="{_escape_field(vp_bucket)}"')
     if grid_id:
-        fields.append(f'grid="{_escape_field(grid_id)}"')
-    if el_hash:
-        fields.append(f'el_hash="{_escape_field(el_hash)}"')
-
-    payload_data: Dict[str, Any] = {
-        "site": site,
-        "type": event_type,
-        "route": route,
-        "route_norm": route_norm,
-        "path": path_field,
-        "source": event.get("source"),
-        "trigger": event.get("trigger"),
-        "depth": depth,
-        "sec": sec,
-        "ts": timestamp_ms,
-        "snapshot_hash": snapshot_hash,
-        "grid_id": grid_id,
-        "vp_bucket": vp_bucket,
-    }
-    if client_host:
-        payload_data["ip"] = client_host
-    if element:
-        payload_data["element"] = element
-    if element_text:
-        payload_data["element_text"] = element_text
+        append(f',grid="{_escape_field(grid_id)}"')
     if el_hash:
-        payload_data["el_hash"] = el_hash
-    coords_payload: Dict[str, Any] = {}
-    if raw_cx is not None:
-        coords_payload["x"] = cx
-    if raw_cy is not None:
-        coords_payload["y"] = cy
-    if raw_px is not None:
-        coords_payload["pageX"] = page_x
-    if raw_py is not None:
-        coords_payload["pageY"] = page_y
-    if coords_payload:
-        payload_data["coords"] = coords_payload
-    if section:
-        payload_data["section"] = section
-    if x_bin_value is not None:
-        payload_data["x_bin"] = _coerce_int(x_bin_value, 0)
-    if y_bin_value is not None:
-        payload_data["y_bin"] = _coerce_int(y_bin_value, 0)
-    if doc_x_value >= 0:
-        payload_data["doc_x"] = doc_x_value
-    if doc_y_value >= 0:
-        payload_data["doc_y"] = doc_y_value
-    if doc_w > 0:
-        payload_data["doc_w"] = doc_w
-    if doc_h > 0:
-        payload_data["doc_h"] = doc_h
-    if "scroll_top" in event:
-        payload_data["scroll_top"] = scroll_top or 0
-    if "scroll_height" in event:
-        payload_data["scroll_height"] = scroll_height or 0
-    if "viewport_height" in event:
-        payload_data["viewport_height"] = viewport_height or 0
-    event_id = event.get("event_id")
-    if isinstance(event_id, str) and event_id:
-        payload_data["event_id"] = event_id
-    uid = event.get("uid")
-    if isinstance(uid, str) and uid:
-        payload_data["uid"] = uid
-    sid = event.get("sid")
-    if isinstance(sid, str) and sid:
-        payload_data["sid"] = sid
-    if vp_w or vp_h or vp_dpr:
-        payload_data["vp"] = {"w": vp_w, "h": vp_h, "dpr": vp_dpr}
-
-    try:
-        payload_json = json.dumps(payload_data, separators=(",", ":"))
-        fields.append(f'payload="{_escape_field(payload_json)}"')
-    except (TypeError, ValueError):
-        pass
-    line = (
-        f"logflow,site={_escape_tag(site)},t={_escape_tag(event_type)},route={_escape_tag(route)} "
-        f"{','.join(fields)} {timestamp_ms}"
-    )
+        append(f',el_hash="{_escape_field(el_hash)}"')
+
+    if INCLUDE_PAYLOAD:
+        payload_data: Dict[str, Any] = {
+            "site": site,
+            "type": event_type,
+            "route": route,
+            "route_norm": route_norm,
+            "path": path_field,
+            "source": event.get("source"),
+            "trigger": event.get("trigger"),
+            "depth": depth,
+            "sec": sec,
+            "ts": timestamp_ms,
+            "snapshot_hash": snapshot_hash,
+            "grid_id": grid_id,
+            "vp_bucket": vp_bucket,
+        }
+        if client_host:
+            payload_data["ip"] = client_host
+        if element:
+            payload_data["element"] = element
+        if element_text:
+            payload_data["element_text"] = element_text
+        if el_hash:
+            payload_data["el_hash"] = el_hash
+        coords_payload: Dict[str, Any] = {}
+        if raw_cx is not None:
+            coords_payload["x"] = cx
+        if raw_cy is not None:
+            coords_payload["y"] = cy
+        if raw_px is not None:
+            coords_payload["pageX"] = page_x
+        if raw_py is not None:
+            coords_payload["pageY"] = page_y
+        if coords_payload:
+            payload_data["coords"] = coords_payload
+        if section:
+            payload_data["section"] = section
+        if x_bin_value is not None:
+            payload_data["x_bin"] = _coerce_int(x_bin_value, 0)
+        if y_bin_value is not None:
+            payload_data["y_bin"] = _coerce_int(y_bin_value, 0)
+        if doc_x_value >= 0:
+            payload_data["doc_x"] = doc_x_value
+        if doc_y_value >= 0:
+            payload_data["doc_y"] = doc_y_value
+        if doc_w > 0:
+            payload_data["doc_w"] = doc_w
+        if doc_h > 0:
+            payload_data["doc_h"] = doc_h
+        if "scroll_top" in event:
+            payload_data["scroll_top"] = scroll_top or 0
+        if "scroll_height" in event:
+            payload_data["scroll_height"] = scroll_height or 0
+        if "viewport_height" in event:
+            payload_data["viewport_height"] = viewport_height or 0
+        event_id = event.get("event_id")
+        if isinstance(event_id, str) and event_id:
+            payload_data["event_id"] = event_id
+        uid = event.get("uid")
+        if isinstance(uid, str) and uid:
+            payload_data["uid"] = uid
+        sid = event.get("sid")
+        if isinstance(sid, str) and sid:
+            payload_data["sid"] = sid
+        if vp_w or vp_h or vp_dpr:
+            payload_data["vp"] = {"w": vp_w, "h": vp_h, "dpr": vp_dpr}
 
-    try:
-        await _write_line(request, line, cfg)
-    except Exception as exc:  # pragma: no cover - defensive
-        logger.warning("Unexpected error writing analytics event: %s", exc)
+        try:
+            payload_json = orjson.dumps(payload_data).decode("utf-8")
+            append(f',payload="{_escape_field(payload_json)}"')
+        except (TypeError, ValueError):
+            pass
+    append(f" {timestamp_ms}")
+    _enqueue_line(request, "".join(parts).encode("utf-8"))
 
     if event_type == "click":
-        x_bin = _coerce_int(event.get("x_bin"), -1)
-        y_bin = _coerce_int(event.get("y_bin"), -1)
+        x_bin = _coerce_int(x_bin_value, -1)
+        y_bin = _coerce_int(y_bin_value, -1)
         section_value = section or "unspecified"
         if x_bin >= 0 and y_bin >= 0:
-            click_fields = [
-                "count=1i",
-                f"x_bin={x_bin}i",
-                f"y_bin={y_bin}i",
-            ]
+            click_parts = [f"count=1i,x_bin={x_bin}i,y_bin={y_bin}i"]
             if doc_x_value >= 0:
-                click_fields.append(f"doc_x={_format_float(doc_x_value)}")
+                click_parts.append(f",doc_x={_format_float(doc_x_value)}")
             if doc_y_value >= 0:
-                click_fields.append(f"doc_y={_format_float(doc_y_value)}")
+                click_parts.append(f",doc_y={_format_float(doc_y_value)}")
             if doc_w > 0:
-                click_fields.append(f"doc_w={doc_w}i")
+                click_parts.append(f",doc_w={doc_w}i")
             if doc_h > 0:
-                click_fields.append(f"doc_h={doc_h}i")
+                click_parts.append(f",doc_h={doc_h}i")
             if raw_px is not None:
-                click_fields.append(f"px={page_x}i")
+                click_parts.append(f",px={page_x}i")
             if raw_py is not None:
-                click_fields.append(f"py={page_y}i")
+                click_parts.append(f",py={page_y}i")
             click_tags = [
                 ("site", site),
                 ("route", route),
@@ -327,11 +477,8 @@ async def ingest(request: Request) -> Response:
             if el_hash:
                 click_tags.append(("el", el_hash))
             tag_str = ",".join(f"{name}={_escape_tag(value)}" for name, value in click_tags if value)
-            click_line = f"logflow_click,{tag_str} {','.join(click_fields)} {timestamp_ms}"
-            try:
-                await _write_line(request, click_line, cfg)
-            except Exception as exc:  # pragma: no cover - defensive
-                logger.warning("Unexpected error writing click analytics event: %s", exc)
+            click_line = f"logflow_click,{tag_str} {''.join(click_parts)} {timestamp_ms}"
+            _enqueue_line(request, click_line.encode("utf-8"))
 
     return Response(status_code=204)
 
@@ -1,33 +1,63 @@
-import json
 import os
+import threading
+import time
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import orjson
 
 
 BASE_DIR = Path(__file__).resolve().parent
 HEATMAP_CACHE_DIR = Path(os.getenv("HEATMAP_CACHE_DIR", str(BASE_DIR / "heatmap_cache"))).expanduser()
 HEATMAP_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+_HEATMAP_CACHE_DIR_STR = str(HEATMAP_CACHE_DIR)
+META_INDEX_TTL = max(0.0, float(os.getenv("HEATMAP_META_INDEX_TTL", "60")))
+
+# meta.json contents keyed by path. Writes from this process update it in
+# place; the tree is rescanned at most every META_INDEX_TTL seconds to pick up
+# files written by other workers.
+_META_INDEX: Dict[str, Dict[str, Any]] = {}
+_META_SCANNED_AT: Optional[float] = None
+# Bumped whenever the index changes, so derived views can be cached per value.
+_META_GENERATION = 0
+_META_LOCK = threading.Lock()
+
+
+class _SegmentTable(dict):
+    # str.translate table filled lazily so non-ASCII keeps isalnum() semantics;
+    # only ASCII entries are memoized to keep the table bounded.
+    def __missing__(self, codepoint: int) -> str:
+        ch = chr(codepoint)
+        mapped = ch if ch.isalnum() or ch in "-_." else "_"
+        if codepoint < 128:
+            self[codepoint] = mapped
+        return mapped
+
+
+_SEGMENT_TABLE = _SegmentTable({ord("/"): "__", ord("\\"): "__"})
+_SEGMENT_MEMO_MAX_LEN = 256
 
 
 def safe_cache_segment(value: str) -> str:
+    # Only short inputs are memoized; the cache key is the full input, so a
+    # long one would be pinned even though just 80 chars come back.
+    if value and len(value) > _SEGMENT_MEMO_MAX_LEN:
+        return _safe_cache_segment(value)
+    return _safe_cache_segment_cached(value)
+
+
+def _safe_cache_segment(value: str) -> str:
     text = (value or "default").strip()
-    if not text:
-        text = "default"
-    text = text.replace("\\", "/")
-    tokens: List[str] = []
-    for ch in text:
-        if ch.isalnum() or ch in {"-", "_", "."}:
-            tokens.append(ch)
-        elif ch == "/":
-            tokens.append("__")
-        else:
-            tokens.append("_")
-    cleaned = "".join(tokens).strip("_")
+    cleaned = text.translate(_SEGMENT_TABLE).strip("_")
     if not cleaned:
         cleaned = "default"
     return cleaned[:80]
 
 
+_safe_cache_segment_cached = lru_cache(maxsize=4096)(_safe_cache_segment)
+
+
 def _snapshot_parts(
     route_norm: str,
     snapshot_hash: str,
@@ -48,6 +78,7 @@ def _snapshot_parts(
     )
 
 
+@lru_cache(maxsize=1024)
 def snapshot_cache_path(
     route_norm: str,
     snapshot_hash: str,
@@ -58,7 +89,9 @@ def snapshot_cache_path(
 ) -> Path:
     parts = _snapshot_parts(route_norm, snapshot_hash, vp_bucket, grid_id, section)
     filename = f"snapshot.{extension.strip('.') or 'webp'}"
-    return HEATMAP_CACHE_DIR.joinpath(*parts, filename)
+    # Segments are sanitized (no separators), so a plain join is equivalent to
+    # joinpath and builds a single Path instead of one per component.
+    return Path(os.sep.join((_HEATMAP_CACHE_DIR_STR, *parts, filename)))
 
 
 def snapshot_cache_relative(
@@ -71,26 +104,74 @@ def snapshot_cache_relative(
 ) -> str:
     parts = _snapshot_parts(route_norm, snapshot_hash, vp_bucket, grid_id, section)
     filename = f"snapshot.{extension.strip('.') or 'webp'}"
-    return str(Path(*parts, filename))
+    return os.sep.join((*parts, filename))
 
 
 def write_metadata(cache_path: Path, metadata: Dict[str, Any]) -> None:
-    meta_path = cache_path.with_name("meta.json")
-    meta_path.parent.mkdir(parents=True, exist_ok=True)
-    meta_path.write_text(json.dumps(metadata, ensure_ascii=False, indent=2), encoding="utf-8")
+    parent = os.path.dirname(os.fspath(cache_path))
+    os.makedirs(parent, exist_ok=True)
+    meta_path = os.path.join(parent, "meta.json")
+    # Write then rename so concurrent readers never see a partial file.
+    tmp_path = f"{meta_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as handle:
+        handle.write(orjson.dumps(metadata, option=orjson.OPT_INDENT_2))
+    os.replace(tmp_path, meta_path)
+    global _META_GENERATION
+    with _META_LOCK:
+        _META_INDEX[meta_path] = dict(metadata)
+        _META_GENERATION += 1
 
 
-def load_metadata(snapshot_hash: Optional[str] = None) -> List[Dict[str, Any]]:
-    entries: List[Dict[str, Any]] = []
-    base = HEATMAP_CACHE_DIR
-    if not base.exists():
-        return entries
-    for meta_path in base.rglob("meta.json"):
+def _iter_meta_paths(base: str) -> Iterator[str]:
+    # Explicit scandir walk: directory entries carry their type, so no extra
+    # stat per entry and no Path objects are built while descending.
+    stack = [base]
+    while stack:
         try:
-            data = json.loads(meta_path.read_text(encoding="utf-8"))
-        except Exception:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name == "meta.json" and entry.is_file(follow_symlinks=False):
+                        yield entry.path
+        except OSError:
             continue
-        if snapshot_hash and data.get("snapshot_hash") != snapshot_hash:
+
+
+def _scan_metadata() -> Dict[str, Dict[str, Any]]:
+    index: Dict[str, Dict[str, Any]] = {}
+    for meta_path in _iter_meta_paths(_HEATMAP_CACHE_DIR_STR):
+        try:
+            with open(meta_path, "rb") as handle:
+                data = orjson.loads(handle.read())
+        except Exception:
             continue
-        entries.append(data)
+        if isinstance(data, dict):
+            index[meta_path] = data
+    return index
+
+
+def _refresh_metadata_locked() -> None:
+    global _META_SCANNED_AT, _META_GENERATION
+    now = time.monotonic()
+    if _META_SCANNED_AT is None or now - _META_SCANNED_AT >= META_INDEX_TTL:
+        _META_INDEX.clear()
+        _META_INDEX.update(_scan_metadata())
+        _META_SCANNED_AT = now
+        _META_GENERATION += 1
+
+
+def metadata_generation() -> int:
+    with _META_LOCK:
+        _refresh_metadata_locked()
+        return _META_GENERATION
+
+
+def load_metadata(snapshot_hash: Optional[str] = None) -> List[Dict[str, Any]]:
+    # Entries are shared with the index; callers must treat them as read-only.
+    with _META_LOCK:
+        _refresh_metadata_locked()
+        entries = list(_META_INDEX.values())
+    if snapshot_hash:
+        entries = [data for data in entries if data.get("snapshot_hash") == snapshot_hash]
     return entries
@@ -1,28 +1,37 @@
+import asyncio
 import hashlib
-import json
+import heapq
 import logging
 import os
-from contextlib import asynccontextmanager
+import time
+from contextlib import asynccontextmanager, suppress
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Set, Tuple
-from urllib.parse import urlencode
+from types import MappingProxyType
+from typing import Any, Dict, FrozenSet, List, Mapping, Optional, Set, Tuple
+from urllib.parse import quote_plus, urlencode
 
 import httpx
+import orjson
 from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi.responses import FileResponse, HTMLResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 
-from .api import _escape_flux, _parse_flux_csv, router as api_router
-from .ba import _get_influx_config, _normalize_route, router as ba_router
-from .cache_utils import HEATMAP_CACHE_DIR, load_metadata, snapshot_cache_path
+from .api import _bucket_source, _escape_flux, _stream_flux, _to_int, router as api_router
+from .ba import WRITE_QUEUE_MAX, _normalize_route, _run_write_flusher, router as ba_router
+from .cache_utils import HEATMAP_CACHE_DIR, load_metadata, metadata_generation, snapshot_cache_path
 from .snapshot import router as snapshot_router
 
 BASE_DIR = Path(__file__).resolve().parent
 BA_JS_PATH = BASE_DIR / "static" / "ba.js"
 templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
+# Loaded once so rendering skips the loader's per-request lookup and mtime check.
+_HEATMAP_TEMPLATE = templates.get_template("heatmap.html")
+# index.html has no dynamic context, so it is rendered once at import.
+_INDEX_HTML = templates.get_template("index.html").render()
 logger = logging.getLogger("uvicorn.error")
 
 
@@ -55,16 +64,45 @@ def _parse_int_env(name: str, default: int, minimum: int = 1) -> int:
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    client = httpx.AsyncClient(timeout=httpx.Timeout(5.0, connect=2.0))
+    # Single pooled client shared by every Influx read/write so requests reuse
+    # keep-alive connections instead of opening one per call. The keep-alive
+    # pool is sized for dashboard fan-out plus the write flusher.
+    client = httpx.AsyncClient(
+        timeout=httpx.Timeout(10.0, connect=3.0),
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=40, keepalive_expiry=30.0),
+    )
     app.state.http_client = client
+    app.state.write_queue = asyncio.Queue(maxsize=WRITE_QUEUE_MAX)
+    app.state.write_dropped = 0
+    app.state.heatmap_cache = {}
+    app.state.heatmap_inflight = {}
+    app.state.heatmap_pages = {}
+    flusher = asyncio.create_task(_run_write_flusher(app))
     try:
         yield
     finally:
+        flusher.cancel()
+        with suppress(asyncio.CancelledError):
+            await flusher
         await client.aclose()
 
 
 app = FastAPI(lifespan=lifespan)
 
+class _CORSMiddleware(CORSMiddleware):
+    # Origin checks run per request: use a set instead of the list Starlette
+    # keeps, and accept any origin without the regex in wildcard mode.
+    def __init__(self, app: Any, **kwargs: Any) -> None:
+        super().__init__(app, **kwargs)
+        self.allow_origins = frozenset(self.allow_origins)
+        self.allow_any_origin = self.allow_origin_regex is not None and self.allow_origin_regex.pattern == ".*"
+
+    def is_allowed_origin(self, origin: str) -> bool:
+        if self.allow_any_origin:
+            return True
+        return super().is_allowed_origin(origin)
+
+
 allow_origins = _parse_origins(os.getenv("ALLOW_ORIGINS", "*"))
 allow_origin_regex = None
 if allow_origins == ["*"]:
@@ -73,7 +111,7 @@ if allow_origins == ["*"]:
     allow_origins = []
 allow_credentials = _parse_bool_env("ALLOW_CREDENTIALS", default=True)
 app.add_middleware(
-    CORSMiddleware,
+    _CORSMiddleware,
     allow_origins=allow_origins,
     allow_origin_regex=allow_origin_regex,
     allow_credentials=allow_credentials,
@@ -84,6 +122,35 @@ app.add_middleware(
 HEATMAP_LOOKBACK_HOURS = _parse_int_env("HEATMAP_LOOKBACK_HOURS", default=24, minimum=1)
 HEATMAP_COLS = _parse_int_env("HEATMAP_COLS", default=12, minimum=1)
 HEATMAP_ROWS = _parse_int_env("HEATMAP_ROWS", default=8, minimum=1)
+# Upper bound for a requested grid's cols/rows. Larger grids fall back to the
+# default, so one request cannot pin megabytes in the page and grid caches.
+HEATMAP_MAX_GRID_DIM = max(_parse_int_env("HEATMAP_MAX_GRID_DIM", default=100, minimum=1), HEATMAP_COLS, HEATMAP_ROWS)
+HEATMAP_CACHE_TTL = _parse_int_env("HEATMAP_CACHE_TTL", default=30, minimum=0)
+HEATMAP_CACHE_MAX_ENTRIES = 256
+HEATMAP_PAGE_CACHE_MAX_ENTRIES = 64
+# (size, mtime_ns, sha256) per snapshot file, so an unchanged file is hashed
+# at most once per process. Bounded by the number of cached snapshots.
+_SNAPSHOT_DIGESTS: Dict[str, Tuple[int, int, str]] = {}
+_CACHE_DIR_PREFIX = os.path.join(os.fspath(HEATMAP_CACHE_DIR), "")
+_ROUTE_LINKS_MAX = 16
+_SNAPSHOT_WILDCARDS = frozenset({"*", "all", "any"})
+_VP_WILDCARDS = frozenset({"", "*", "any"})
+_SECTION_WILDCARDS = frozenset({"", "*", "all", "__all__"})
+_ROUTE_LINKS_WINDOW = 64
+_HEATMAP_COLUMNS = ("x_bin", "y_bin", "count", "_value")
+# Only the three fields the grid needs are read and pivoted. Tags stay in the
+# group key through the pivot, so `_time` alone identifies a point's row.
+_HEATMAP_QUERY = (
+    "{source}"
+    "  |> range(start: -{hours}h)\n"
+    '  |> filter(fn: (r) => r["_measurement"] == "logflow_click")\n'
+    '  |> filter(fn: (r) => r["_field"] == "count" or r["_field"] == "x_bin" or r["_field"] == "y_bin")\n'
+    "{filters}"
+    '  |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")\n'
+    '  |> keep(columns: ["x_bin", "y_bin", "count"])\n'
+    '  |> group(columns: ["x_bin", "y_bin"])\n'
+    '  |> sum(column: "count")\n'
+)
 
 app.mount("/static", StaticFiles(directory=str(BASE_DIR / "static")), name="static")
 app.include_router(ba_router)
@@ -92,8 +159,8 @@ app.include_router(snapshot_router)
 
 
 @app.get("/", response_class=HTMLResponse)
-async def index(request: Request) -> HTMLResponse:
-    return templates.TemplateResponse("index.html", {"request": request})
+async def index() -> HTMLResponse:
+    return HTMLResponse(_INDEX_HTML)
 
 
 @app.get("/ba.js")
@@ -101,30 +168,26 @@ async def snippet() -> FileResponse:
     return FileResponse(BA_JS_PATH, media_type="application/javascript")
 
 
+# Param lengths match SnapshotRequestPayload. They also bound the keys and
+# values held by the filter, query, route-link and page caches.
 @app.get("/heatmap", response_class=HTMLResponse)
 async def heatmap(
     request: Request,
-    route: str = Query("/", description="Route path to inspect"),
-    snapshot: str = Query("default", description="Snapshot hash identifier"),
-    vp: str = Query("", description="Viewport bucket identifier"),
-    grid: Optional[str] = Query(None, description="Grid identifier, e.g. 12x8"),
-    section: Optional[str] = Query(None, description="Section label"),
-    site: Optional[str] = Query(None, description="Site identifier"),
+    route: str = Query("/", max_length=320, description="Route path to inspect"),
+    snapshot: str = Query("default", max_length=120, description="Snapshot hash identifier"),
+    vp: str = Query("", max_length=60, description="Viewport bucket identifier"),
+    grid: Optional[str] = Query(None, max_length=60, description="Grid identifier, e.g. 12x8"),
+    section: Optional[str] = Query(None, max_length=60, description="Section label"),
+    site: Optional[str] = Query(None, max_length=120, description="Site identifier"),
     hours: int = Query(HEATMAP_LOOKBACK_HOURS, ge=1, le=168, description="Lookback window in hours"),
-) -> HTMLResponse:
+) -> Response:
     route_norm = _normalize_route(route or "/")
     cols, rows, grid_id = _parse_grid_identifier(grid, HEATMAP_COLS, HEATMAP_ROWS)
 
-    snapshot_param = (snapshot or "").strip()
+    snapshot_param, snapshot_filter = _clean_filter_param(snapshot, _SNAPSHOT_WILDCARDS, "default")
     snapshot_hash = snapshot_param or "default"
-    snapshot_filter = None if snapshot_hash.lower() in {"*", "all", "any"} else snapshot_hash
-
-    vp_param = (vp or "").strip()
-    vp_filter = None if vp_param.lower() in {"", "*", "any"} else vp_param
-
-    section_param = (section or "").strip()
-    section_filter = None if section_param.lower() in {"", "*", "all", "__all__"} else section_param
-
+    vp_param, vp_filter = _clean_filter_param(vp, _VP_WILDCARDS)
+    section_param, section_filter = _clean_filter_param(section, _SECTION_WILDCARDS)
     site_param = (site or "").strip()
 
     heatmap_data = await _build_heatmap_grid(
@@ -156,7 +219,9 @@ async def heatmap(
     cache_vp_key = vp_param if vp_filter else "any"
     cache_section_key = section_param if section_filter else "all"
 
-    snapshot_info = _snapshot_media_info(
+    # stat, meta.json and a possible first-time hash run off the event loop.
+    snapshot_info = await asyncio.to_thread(
+        _snapshot_media_info,
         route_norm=route_norm,
         snapshot_hash=cache_snapshot_key,
         vp_bucket=cache_vp_key,
@@ -177,16 +242,10 @@ async def heatmap(
             etag=etag,
         )
 
-    try:
-        cache_rel = cache_path.relative_to(HEATMAP_CACHE_DIR)
-    except ValueError:
-        cache_rel = cache_path
-
     context = {
-        "request": request,
-        "grid": heatmap_data["grid"],
+        "grid_json": heatmap_data["grid_json"],
         "raw_grid": heatmap_data["raw"],
-        "cells": heatmap_data["cells"],
+        "top_cells": heatmap_data["top_cells"],
         "cols": cols,
         "rows": rows,
         "hours": hours,
@@ -204,8 +263,8 @@ async def heatmap(
         "snapshot_size": _format_filesize(snapshot_info["size_bytes"]),
         "snapshot_aspect_ratio": _format_aspect_ratio(metadata),
         "snapshot_captured": _format_timestamp(metadata.get("captured_at")) if metadata else "",
-        "cache_path": str(cache_rel),
-        "cache_full_path": str(cache_path),
+        "cache_path": snapshot_info["relative_path"],
+        "cache_full_path": snapshot_info["full_path"],
         "cached_routes": cached_routes,
         "filters": {
             "site": site_param or "",
@@ -217,10 +276,40 @@ async def heatmap(
             "hours": hours,
         },
     }
-    response = templates.TemplateResponse("heatmap.html", context)
-    if etag:
-        response.headers["ETag"] = etag
-    return response
+    # The page validator covers everything rendered (click data, filters,
+    # snapshot digest and metadata), so a revalidation skips the render.
+    page_etag = f'W/"{hashlib.blake2b(orjson.dumps(context), digest_size=16).hexdigest()}"'
+    if _etag_matches(request.headers.get("if-none-match"), page_etag):
+        return Response(status_code=304, headers={"ETag": page_etag})
+    # The validator hashes the full context, so it also keys the rendered page:
+    # repeat views of unchanged data skip Jinja entirely. Grid size and param
+    # lengths are capped, so each page stays under ~100 KB.
+    pages: Dict[str, bytes] = request.app.state.heatmap_pages
+    body = pages.get(page_etag)
+    if body is None:
+        body = _HEATMAP_TEMPLATE.render(context).encode("utf-8")
+        if len(pages) >= HEATMAP_PAGE_CACHE_MAX_ENTRIES:
+            del pages[next(iter(pages))]
+        pages[page_etag] = body
+    return HTMLResponse(body, headers={"ETag": page_etag})
+
+
+@lru_cache(maxsize=1024)
+def _clean_filter_param(raw: Optional[str], wildcards: FrozenSet[str], default: str = "") -> Tuple[str, Optional[str]]:
+    # Returns the stripped parameter and the Flux filter value (None = any).
+    param = (raw or "").strip()
+    value = param or default
+    return param, None if value.lower() in wildcards else value
+
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    # If-None-Match uses weak comparison, so W/ prefixes are ignored.
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == opaque for candidate in header.split(","))
 
 
 def _build_cached_route_links(
@@ -237,52 +326,68 @@ def _build_cached_route_links(
 ) -> List[Dict[str, Any]]:
     if not snapshot_hash:
         snapshot_hash = "default"
+    # Every viewer of a snapshot gets the same list; it is rebuilt only when
+    # the metadata index changes.
+    return _route_links_for(
+        metadata_generation(),
+        snapshot_hash,
+        route_norm,
+        snapshot_param,
+        vp_param,
+        grid_param,
+        section_param,
+        site_param,
+        hours,
+    )
+
+
+@lru_cache(maxsize=256)
+def _route_links_for(
+    generation: int,
+    snapshot_hash: str,
+    route_norm: str,
+    snapshot_param: str,
+    vp_param: str,
+    grid_param: Optional[str],
+    section_param: str,
+    site_param: str,
+    hours: int,
+) -> List[Dict[str, Any]]:
     entries = load_metadata(snapshot_hash)
     if not entries:
         return []
-    filtered: List[Dict[str, Any]] = []
-    for entry in entries:
-        if site_param and entry.get("site") and entry.get("site") != site_param:
-            continue
-        route_value = entry.get("route") or entry.get("route_norm")
-        if not route_value:
-            continue
-        norm_value = entry.get("route_norm") or _normalize_route(route_value)
-        filtered.append(
-            {
-                "route": route_value,
-                "route_norm": norm_value,
-                "captured_at": entry.get("captured_at"),
-                "width": entry.get("width"),
-                "height": entry.get("height"),
-                "bytes": entry.get("bytes"),
-                "format": entry.get("format") or "webp",
-                "vp_bucket": entry.get("vp_bucket"),
-                "grid_id": entry.get("grid_id"),
-                "section": entry.get("section"),
-            }
-        )
-    if not filtered:
+    candidates = [
+        entry
+        for entry in entries
+        if (entry.get("route") or entry.get("route_norm"))
+        and not (site_param and entry.get("site") and entry.get("site") != site_param)
+    ]
+    if not candidates:
         return []
-    filtered.sort(key=lambda item: item.get("captured_at") or 0, reverse=True)
+    # Only the newest 16 distinct routes are shown. nlargest keeps the order of
+    # a stable reverse sort; fall back to the full sort if duplicates leave the
+    # over-fetched window short.
+    newest = heapq.nlargest(_ROUTE_LINKS_WINDOW, candidates, key=_captured_at_key)
+    if len(candidates) > _ROUTE_LINKS_WINDOW and len({_route_key(entry) for entry in newest}) < _ROUTE_LINKS_MAX:
+        newest = sorted(candidates, key=_captured_at_key, reverse=True)
+    query_suffix = _heatmap_link_suffix(
+        snapshot_param=snapshot_param,
+        vp_param=vp_param,
+        grid_param=grid_param,
+        section_param=section_param,
+        site_param=site_param,
+        hours=hours,
+    )
     seen: Set[str] = set()
     links: List[Dict[str, Any]] = []
-    for item in filtered:
-        route_value = item["route"]
-        norm_value = item["route_norm"]
+    for item in newest:
+        route_value = item.get("route") or item.get("route_norm")
+        norm_value = item.get("route_norm") or _normalize_route(route_value)
         key = norm_value or route_value
         if key in seen:
             continue
         seen.add(key)
-        url = _build_heatmap_link(
-            route_value=route_value,
-            snapshot_param=snapshot_param,
-            vp_param=vp_param,
-            grid_param=grid_param,
-            section_param=section_param,
-            site_param=site_param,
-            hours=hours,
-        )
+        url = _build_heatmap_link(route_value, query_suffix)
         links.append(
             {
                 "route": route_value or norm_value,
@@ -295,14 +400,26 @@ def _build_cached_route_links(
                 "active": norm_value == route_norm,
             }
         )
-        if len(links) >= 16:
+        if len(links) >= _ROUTE_LINKS_MAX:
             break
     return links
 
 
-def _build_heatmap_link(
+def _captured_at_key(entry: Dict[str, Any]) -> Any:
+    return entry.get("captured_at") or 0
+
+
+def _route_key(entry: Dict[str, Any]) -> str:
+    route_value = entry.get("route") or entry.get("route_norm")
+    return entry.get("route_norm") or _normalize_route(route_value) or route_value
+
+
+def _build_heatmap_link(route_value: str, query_suffix: str) -> str:
+    return f"/heatmap?route={quote_plus(route_value or '/')}{query_suffix}"
+
+
+def _heatmap_link_suffix(
     *,
-    route_value: str,
     snapshot_param: str,
     vp_param: str,
     grid_param: Optional[str],
@@ -310,8 +427,8 @@ def _build_heatmap_link(
     site_param: str,
     hours: int,
 ) -> str:
+    # Query parameters shared by every link in the route list; encoded once.
     params: List[Tuple[str, str]] = []
-    params.append(("route", route_value or "/"))
     if snapshot_param:
         params.append(("snapshot", snapshot_param))
     if vp_param:
@@ -324,15 +441,26 @@ def _build_heatmap_link(
         params.append(("site", site_param))
     if hours:
         params.append(("hours", str(hours)))
-    query = urlencode(params)
-    return f"/heatmap?{query}"
+    if not params:
+        return ""
+    return f"&{urlencode(params)}"
 
 
 def _format_timestamp(value: Any) -> str:
+    # captured_at is normally an int; it hashes like its float value, so it
+    # can key the cache directly.
+    if value.__class__ is int or value.__class__ is float:
+        return _format_epoch(value)
     try:
         timestamp = float(value)
     except (TypeError, ValueError):
         return ""
+    return _format_epoch(timestamp)
+
+
+# Snapshot capture times repeat across every render of the route list.
+@lru_cache(maxsize=4096)
+def _format_epoch(timestamp: float) -> str:
     if timestamp > 10_000_000_000:
         timestamp = timestamp / 1000.0
     try:
@@ -354,7 +482,7 @@ async def _build_heatmap_grid(
     cols: int,
     rows: int,
     section: Optional[str],
-) -> Dict[str, Any]:
+) -> Mapping[str, Any]:
     raw_rows = await _fetch_heatmap_rows(
         request,
         hours=hours,
@@ -365,57 +493,59 @@ async def _build_heatmap_grid(
         grid_id=grid_id,
         section=section,
     )
-    raw_grid = [[0 for _ in range(cols)] for _ in range(rows)]
-    max_count = 0
+    if not raw_rows:
+        return _empty_heatmap_grid(cols, rows)
+    # Accumulate into one flat row-major list; rows are sliced out at the end.
+    flat = [0] * (cols * rows)
     total_count = 0
 
-    for entry in raw_rows:
-        x_value = entry.get("x_bin")
-        y_value = entry.get("y_bin")
-        count_value = entry.get("count") or entry.get("_value")
-        try:
-            x_idx = int(float(x_value))
-            y_idx = int(float(y_value))
-            count = int(float(count_value))
-        except (TypeError, ValueError):
-            continue
+    for x_idx, y_idx, count in raw_rows:
         if not (0 <= x_idx < cols and 0 <= y_idx < rows):
             continue
-        raw_grid[y_idx][x_idx] += count
+        flat[y_idx * cols + x_idx] += count
         total_count += count
-        if raw_grid[y_idx][x_idx] > max_count:
-            max_count = raw_grid[y_idx][x_idx]
+
+    max_count = max(max(flat), 0)
+    raw_grid = [flat[offset : offset + cols] for offset in range(0, len(flat), cols)]
 
     if max_count > 0:
-        normalized_grid = [
-            [raw_grid[y][x] / max_count for x in range(cols)] for y in range(rows)
-        ]
+        normalized = [count / max_count for count in flat]
     else:
-        normalized_grid = [[0.0 for _ in range(cols)] for _ in range(rows)]
-
-    cells: List[Dict[str, float]] = []
-    for y in range(rows):
-        for x in range(cols):
-            count = raw_grid[y][x]
-            alpha = (count / max_count) if max_count else 0.0
-            cells.append(
-                {
-                    "x": x,
-                    "y": y,
-                    "count": count,
-                    "alpha": round(alpha, 4) if alpha else 0.0,
-                }
-            )
+        normalized = [0.0] * len(flat)
+
+    # Only the ten busiest cells are rendered in the table; pick them here
+    # rather than building a dict per grid cell for the template to sort.
+    busiest = heapq.nlargest(10, (index for index, count in enumerate(flat) if count > 0), key=flat.__getitem__)
+    top_cells = [
+        {"x": index % cols, "y": index // cols, "count": flat[index], "alpha": round(normalized[index], 4)}
+        for index in busiest
+    ]
 
     return {
-        "grid": normalized_grid,
         "raw": raw_grid,
+        # Flat row-major alphas; the page builds the overlay cells from this.
+        "grid_json": orjson.dumps([round(alpha, 3) for alpha in normalized]).decode(),
         "max_count": max_count,
         "total_count": total_count,
-        "cells": cells,
+        "top_cells": top_cells,
     }
 
 
+@lru_cache(maxsize=32)
+def _empty_heatmap_grid(cols: int, rows: int) -> Mapping[str, Any]:
+    # Shared read-only payload for filter combos with no clicks yet; cols/rows
+    # are capped by _parse_grid_identifier, so each entry stays small.
+    return MappingProxyType(
+        {
+            "raw": ((0,) * cols,) * rows,
+            "grid_json": orjson.dumps([0.0] * (cols * rows)).decode(),
+            "max_count": 0,
+            "total_count": 0,
+            "top_cells": (),
+        }
+    )
+
+
 async def _fetch_heatmap_rows(
     request: Request,
     *,
@@ -426,70 +556,114 @@ async def _fetch_heatmap_rows(
     vp_bucket: Optional[str],
     grid_id: str,
     section: Optional[str],
-) -> List[Dict[str, str]]:
-    cfg = _get_influx_config()
-    filters = ['  |> filter(fn: (r) => r["_measurement"] == "logflow_click")']
+) -> List[Tuple[int, int, int]]:
+    # Viewers of the same heatmap share one Flux query: results are reused for
+    # HEATMAP_CACHE_TTL seconds and concurrent misses await the same task.
+    state = request.app.state
+    key = (hours, site, route_norm, snapshot_hash, vp_bucket, grid_id, section)
+    cached = state.heatmap_cache.get(key)
+    if cached is not None and time.monotonic() - cached[0] < HEATMAP_CACHE_TTL:
+        return cached[1]
+
+    inflight: Dict[Tuple[Any, ...], asyncio.Task] = state.heatmap_inflight
+    task = inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(
+            _query_heatmap_rows(
+                request,
+                hours=hours,
+                site=site,
+                route_norm=route_norm,
+                snapshot_hash=snapshot_hash,
+                vp_bucket=vp_bucket,
+                grid_id=grid_id,
+                section=section,
+            )
+        )
+        inflight[key] = task
+        task.add_done_callback(lambda _: inflight.pop(key, None))
+    # Shielded so a disconnecting viewer does not cancel the query for others.
+    rows = await asyncio.shield(task)
+    if rows is None:
+        return []
+
+    cache = state.heatmap_cache
+    if HEATMAP_CACHE_TTL > 0:
+        now = time.monotonic()
+        if len(cache) >= HEATMAP_CACHE_MAX_ENTRIES:
+            for stale in [k for k, (stamp, _) in cache.items() if now - stamp >= HEATMAP_CACHE_TTL]:
+                del cache[stale]
+            if len(cache) >= HEATMAP_CACHE_MAX_ENTRIES:
+                cache.clear()
+        cache[key] = (now, rows)
+    return rows
+
+
+async def _query_heatmap_rows(
+    request: Request,
+    *,
+    hours: int,
+    site: Optional[str],
+    route_norm: str,
+    snapshot_hash: Optional[str],
+    vp_bucket: Optional[str],
+    grid_id: str,
+    section: Optional[str],
+) -> Optional[List[Tuple[int, int, int]]]:
+    query = _build_heatmap_query(hours, site, route_norm, snapshot_hash, vp_bucket, grid_id, section)
+    return await _query_flux(request, query)
+
+
+@lru_cache(maxsize=512)
+def _build_heatmap_query(
+    hours: int,
+    site: Optional[str],
+    route_norm: str,
+    snapshot_hash: Optional[str],
+    vp_bucket: Optional[str],
+    grid_id: str,
+    section: Optional[str],
+) -> str:
+    filters: List[str] = []
     if site:
-        filters.append(f'  |> filter(fn: (r) => r["site"] == "{_escape_flux(site)}")')
+        filters.append(f'  |> filter(fn: (r) => r["site"] == "{_escape_flux(site)}")\n')
     if route_norm:
-        filters.append(f'  |> filter(fn: (r) => r["route_norm"] == "{_escape_flux(route_norm)}")')
+        filters.append(f'  |> filter(fn: (r) => r["route_norm"] == "{_escape_flux(route_norm)}")\n')
     if snapshot_hash:
-        filters.append(f'  |> filter(fn: (r) => r["snapshot"] == "{_escape_flux(snapshot_hash)}")')
+        filters.append(f'  |> filter(fn: (r) => r["snapshot"] == "{_escape_flux(snapshot_hash)}")\n')
     if grid_id:
-        filters.append(f'  |> filter(fn: (r) => r["grid"] == "{_escape_flux(grid_id)}")')
+        filters.append(f'  |> filter(fn: (r) => r["grid"] == "{_escape_flux(grid_id)}")\n')
     if vp_bucket:
-        filters.append(f'  |> filter(fn: (r) => r["vp"] == "{_escape_flux(vp_bucket)}")')
+        filters.append(f'  |> filter(fn: (r) => r["vp"] == "{_escape_flux(vp_bucket)}")\n')
     if section:
-        filters.append(f'  |> filter(fn: (r) => r["section"] == "{_escape_flux(section)}")')
-
-    filters_str = "\n".join(filters)
-    query = (
-        f'from(bucket: "{_escape_flux(cfg["bucket"])}")\n'
-        f"  |> range(start: -{hours}h)\n"
-        f"{filters_str}\n"
-        '  |> pivot(rowKey: ["_time", "site", "route", "route_norm", "section", "snapshot", "grid", "vp"], columnKey: ["_field"], valueColumn: "_value")\n'
-        '  |> keep(columns: ["_time", "site", "route", "route_norm", "section", "snapshot", "grid", "vp", "count", "x_bin", "y_bin"])\n'
-        '  |> group(columns: ["x_bin", "y_bin"])\n'
-        '  |> sum(column: "count")\n'
-    )
-    rows = await _query_flux(request, query, cfg)
-    return rows
+        filters.append(f'  |> filter(fn: (r) => r["section"] == "{_escape_flux(section)}")\n')
 
+    return _HEATMAP_QUERY.format(source=_bucket_source(), hours=hours, filters="".join(filters))
 
-async def _query_flux(request: Request, query: str, cfg: Dict[str, str]) -> List[Dict[str, str]]:
-    headers = {
-        "Authorization": f"Token {cfg['token']}",
-        "Content-Type": "application/vnd.flux",
-        "Accept": "application/csv",
-    }
-    client: httpx.AsyncClient | None = getattr(request.app.state, "http_client", None)
+
+async def _query_flux(request: Request, query: str) -> Optional[List[Tuple[int, int, int]]]:
+    # Rows are decoded as the body streams in and kept as (x_bin, y_bin, count)
+    # ints, so cached results are parsed once rather than on every render.
+    # Failures (already logged by _stream_flux) return None, rendered as an
+    # empty grid and not cached.
+    rows: List[Tuple[int, int, int]] = []
     try:
-        if client is None:
-            async with httpx.AsyncClient(timeout=httpx.Timeout(10.0, connect=3.0)) as temp_client:
-                response = await temp_client.post(
-                    f"{cfg['url']}/api/v2/query",
-                    params={"org": cfg["org"]},
-                    headers=headers,
-                    content=query.encode("utf-8"),
+        async for entry in _stream_flux(request, query, _HEATMAP_COLUMNS):
+            try:
+                cell = (
+                    _to_int(entry.get("x_bin")),
+                    _to_int(entry.get("y_bin")),
+                    _to_int(entry.get("count") or entry.get("_value")),
                 )
-        else:
-            response = await client.post(
-                f"{cfg['url']}/api/v2/query",
-                params={"org": cfg["org"]},
-                headers=headers,
-                content=query.encode("utf-8"),
-            )
-    except Exception as exc:  # pragma: no cover - defensive
-        logger.warning("Heatmap query request failed: %s", exc)
-        return []
-
-    if response.status_code >= 400:
-        logger.warning("Heatmap query error %s: %s", response.status_code, response.text)
-        return []
-
-    return _parse_flux_csv(response.text)
+            except (TypeError, ValueError):
+                continue
+            rows.append(cell)
+    except HTTPException:
+        return None
+    return rows
 
 
+@lru_cache(maxsize=256)
 def _parse_grid_identifier(grid_id: Optional[str], default_cols: int, default_rows: int) -> Tuple[int, int, str]:
     if grid_id:
         token = grid_id.lower().replace(" ", "").replace("*", "x")
@@ -498,7 +672,8 @@ def _parse_grid_identifier(grid_id: Optional[str], default_cols: int, default_ro
             try:
                 cols = max(1, int(parts[0]))
                 rows = max(1, int(parts[1]))
-                return cols, rows, f"{cols}x{rows}"
+                if cols <= HEATMAP_MAX_GRID_DIM and rows <= HEATMAP_MAX_GRID_DIM:
+                    return cols, rows, f"{cols}x{rows}"
             except ValueError:
                 pass
     return default_cols, default_rows, f"{default_cols}x{default_rows}"
@@ -506,11 +681,11 @@ def _parse_grid_identifier(grid_id: Optional[str], default_cols: int, default_ro
 
 @app.get("/heatmap/media")
 async def heatmap_media(
-    route: str = Query("/", description="Route path to inspect"),
-    snapshot: str = Query("default", description="Snapshot hash identifier"),
-    vp: str = Query("any", description="Viewport bucket identifier"),
-    grid: Optional[str] = Query(None, description="Grid identifier, e.g. 12x8"),
-    section: Optional[str] = Query(None, description="Section label"),
+    route: str = Query("/", max_length=320, description="Route path to inspect"),
+    snapshot: str = Query("default", max_length=120, description="Snapshot hash identifier"),
+    vp: str = Query("any", max_length=60, description="Viewport bucket identifier"),
+    grid: Optional[str] = Query(None, max_length=60, description="Grid identifier, e.g. 12x8"),
+    section: Optional[str] = Query(None, max_length=60, description="Section label"),
 ) -> FileResponse:
     route_norm = _normalize_route(route or "/")
     _, _, grid_id = _parse_grid_identifier(grid, HEATMAP_COLS, HEATMAP_ROWS)
@@ -518,7 +693,8 @@ async def heatmap_media(
     vp_bucket = (vp or "any").strip() or "any"
     section_value = (section or "all").strip() or "all"
 
-    info = _snapshot_media_info(
+    info = await asyncio.to_thread(
+        _snapshot_media_info,
         route_norm=route_norm,
         snapshot_hash=snapshot_hash,
         vp_bucket=vp_bucket,
@@ -545,28 +721,29 @@ def _snapshot_media_info(
 ) -> Dict[str, Any]:
     cache_path = snapshot_cache_path(route_norm, snapshot_hash, vp_bucket, grid_id, section)
     metadata = _read_snapshot_metadata(cache_path)
-    available = cache_path.exists()
+    try:
+        stat_result: Optional[os.stat_result] = cache_path.stat()
+    except OSError:
+        stat_result = None
+    available = stat_result is not None
     etag = metadata.get("sha256")
     size_bytes = 0
-    if available:
-        try:
-            size_bytes = cache_path.stat().st_size
-        except OSError:
-            size_bytes = 0
+    if stat_result is not None:
+        size_bytes = stat_result.st_size
         if not etag:
-            try:
-                with cache_path.open("rb") as file_obj:
-                    etag = hashlib.sha256(file_obj.read()).hexdigest()
-            except OSError:
-                etag = None
-    try:
-        relative = cache_path.relative_to(HEATMAP_CACHE_DIR)
-    except ValueError:
-        relative = cache_path
+            # Not written back to meta.json: a capture landing meanwhile would
+            # be overwritten with stale metadata. _SNAPSHOT_DIGESTS already
+            # keeps repeat requests from rehashing.
+            etag = _snapshot_digest(cache_path, stat_result)
+    # Cache paths are built from the cache dir string, so stripping the prefix
+    # matches relative_to() without the Path part comparison.
+    full_path = os.fspath(cache_path)
+    relative = full_path.removeprefix(_CACHE_DIR_PREFIX)
     metadata.setdefault("format", "webp")
-    metadata.setdefault("rel_path", str(relative).replace("\\", "/"))
+    metadata.setdefault("rel_path", relative.replace("\\", "/"))
     return {
         "path": cache_path,
+        "full_path": full_path,
         "relative_path": relative,
         "available": available,
         "etag": etag,
@@ -575,12 +752,36 @@ def _snapshot_media_info(
     }
 
 
+def _snapshot_digest(cache_path: Path, stat_result: os.stat_result) -> Optional[str]:
+    key = str(cache_path)
+    cached = _SNAPSHOT_DIGESTS.get(key)
+    if cached is not None and cached[0] == stat_result.st_size and cached[1] == stat_result.st_mtime_ns:
+        return cached[2]
+    try:
+        with open(key, "rb") as file_obj:
+            digest = hashlib.file_digest(file_obj, "sha256").hexdigest()
+    except OSError:
+        return None
+    _SNAPSHOT_DIGESTS[key] = (stat_result.st_size, stat_result.st_mtime_ns, digest)
+    return digest
+
+
 def _read_snapshot_metadata(cache_path: Path) -> Dict[str, Any]:
-    meta_path = cache_path.with_name("meta.json")
-    if not meta_path.exists():
+    meta_path = os.path.join(os.path.dirname(cache_path), "meta.json")
+    try:
+        stat_result = os.stat(meta_path)
+    except OSError:
         return {}
+    # Callers add defaults to the result, so hand out a copy of the cached dict.
+    return dict(_load_snapshot_metadata(meta_path, stat_result.st_mtime_ns, stat_result.st_size))
+
+
+@lru_cache(maxsize=1024)
+def _load_snapshot_metadata(meta_path: str, mtime_ns: int, size: int) -> Dict[str, Any]:
+    # mtime/size are part of the key so a rewritten meta.json is parsed again.
     try:
-        return json.loads(meta_path.read_text(encoding="utf-8"))
+        with open(meta_path, "rb") as handle:
+            return orjson.loads(handle.read())
     except Exception as exc:  # pragma: no cover - defensive
         logger.warning("Failed to read snapshot metadata %s: %s", meta_path, exc)
         return {}
@@ -613,6 +814,11 @@ def _format_filesize(value: Any) -> str:
         size = int(value)
     except (TypeError, ValueError):
         return ""
+    return _format_size_label(size)
+
+
+@lru_cache(maxsize=4096)
+def _format_size_label(size: int) -> str:
     if size <= 0:
         return ""
     units = ["B", "KB", "MB", "GB", "TB"]
@@ -1,10 +1,13 @@
+import asyncio
 import logging
 import os
 import time
+from functools import lru_cache
 from typing import Any, Dict, Optional
 from urllib.parse import urlparse
 
 import httpx
+import orjson
 from fastapi import APIRouter, HTTPException, Request, status
 from pydantic import BaseModel, Field
 
@@ -16,6 +19,9 @@ SNAPSHOT_WORKER_TIMEOUT = float(os.getenv("SNAPSHOT_WORKER_TIMEOUT", "45.0"))
 DEFAULT_VIEWPORT_WIDTH = int(os.getenv("SNAPSHOT_VIEWPORT_WIDTH", "1440"))
 DEFAULT_VIEWPORT_HEIGHT = int(os.getenv("SNAPSHOT_VIEWPORT_HEIGHT", "900"))
 DEFAULT_DEVICE_SCALE = float(os.getenv("SNAPSHOT_DEVICE_SCALE", "1.0"))
+_WORKER_TIMEOUT = httpx.Timeout(SNAPSHOT_WORKER_TIMEOUT, connect=5.0)
+_JSON_HEADERS = {"Content-Type": "application/json"}
+_ASCII_CONTROLS = dict.fromkeys([*range(32), 127])
 
 logger = logging.getLogger("uvicorn.error")
 router = APIRouter(prefix="/snapshot", tags=["snapshot"])
@@ -56,7 +62,7 @@ async def request_snapshot(payload: SnapshotRequestPayload, request: Request) ->
     site_value = _clean_token(payload.site, default="default", limit=120)
     snapshot_hash = _clean_token(payload.snapshot_hash, default="default", limit=80)
     vp_bucket = _clean_token(payload.vp_bucket, default="any", limit=40)
-    grid_id = _clean_token(payload.grid_id, default=_default_grid_id(), limit=40)
+    grid_id = _clean_token(payload.grid_id, default=DEFAULT_GRID_ID, limit=40)
     section_value = _clean_token(payload.section, default="all", limit=40)
 
     viewport = payload.viewport or ViewportPayload()
@@ -65,7 +71,9 @@ async def request_snapshot(payload: SnapshotRequestPayload, request: Request) ->
     device_scale = viewport.device_scale_factor or DEFAULT_DEVICE_SCALE
 
     cache_path = snapshot_cache_path(route_value, snapshot_hash, vp_bucket, grid_id, section_value)
-    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    # Filesystem work runs off the event loop so a slow volume cannot stall
+    # other requests.
+    await asyncio.to_thread(cache_path.parent.mkdir, parents=True, exist_ok=True)
     rel_path = snapshot_cache_relative(route_value, snapshot_hash, vp_bucket, grid_id, section_value)
 
     job_payload = {
@@ -80,9 +88,12 @@ async def request_snapshot(payload: SnapshotRequestPayload, request: Request) ->
     }
 
     worker_endpoint = f"{SNAPSHOT_WORKER_URL}/capture"
+    job_body = orjson.dumps(job_payload)
+    # Reuse the app's pooled client so repeat captures keep the worker
+    # connection alive; captures need a longer timeout than Influx calls.
+    client: httpx.AsyncClient = request.app.state.http_client
     try:
-        async with httpx.AsyncClient(timeout=httpx.Timeout(SNAPSHOT_WORKER_TIMEOUT, connect=5.0)) as client:
-            response = await client.post(worker_endpoint, json=job_payload)
+        response = await client.post(worker_endpoint, content=job_body, headers=_JSON_HEADERS, timeout=_WORKER_TIMEOUT)
     except Exception as exc:  # pragma: no cover - defensive
         logger.warning("Snapshot worker request failed: %s", exc)
         raise HTTPException(status_code=502, detail="Snapshot worker unavailable") from exc
@@ -92,14 +103,14 @@ async def request_snapshot(payload: SnapshotRequestPayload, request: Request) ->
         raise HTTPException(status_code=502, detail="Snapshot worker rejected request")
 
     try:
-        result = response.json()
+        result = orjson.loads(response.content)
     except ValueError as exc:
         raise HTTPException(status_code=502, detail="Snapshot worker returned invalid payload") from exc
 
     if not result.get("ok"):
         raise HTTPException(status_code=502, detail=result.get("error") or "Snapshot worker failed")
 
-    captured_at = int(result.get("captured_at") or time.time() * 1000)
+    captured_at = int(result.get("captured_at") or time.time_ns() // 1_000_000)
     width = int(result.get("width") or vp_width)
     height = int(result.get("height") or vp_height)
     size_bytes = int(result.get("bytes") or 0)
@@ -127,7 +138,7 @@ async def request_snapshot(payload: SnapshotRequestPayload, request: Request) ->
         "rel_path": rel_path,
     }
     try:
-        write_metadata(cache_path, metadata)
+        await asyncio.to_thread(write_metadata, cache_path, metadata)
     except Exception as exc:  # pragma: no cover - defensive
         logger.warning("Failed to persist snapshot metadata for %s: %s", cache_path, exc)
 
@@ -157,23 +168,22 @@ async def request_snapshot(payload: SnapshotRequestPayload, request: Request) ->
     }
 
 
+@lru_cache(maxsize=1024)
 def _clean_token(value: Optional[str], *, default: str, limit: int) -> str:
     if not value:
         return default
     text = str(value).strip()
     if not text:
         return default
-    sanitized = "".join(ch for ch in text if 32 <= ord(ch) <= 126)
+    if text.isascii() and text.isprintable():
+        sanitized = text
+    else:
+        # Keep printable ASCII (32-126) only: drop non-ASCII, then controls.
+        sanitized = text.encode("ascii", "ignore").decode("ascii").translate(_ASCII_CONTROLS)
     sanitized = sanitized[:limit]
     return sanitized or default
 
 
-def _default_grid_id() -> str:
-    cols = _parse_int_env("HEATMAP_COLS", default=12, minimum=1)
-    rows = _parse_int_env("HEATMAP_ROWS", default=8, minimum=1)
-    return f"{cols}x{rows}"
-
-
 def _parse_int_env(name: str, *, default: int, minimum: int = 1) -> int:
     value = os.getenv(name)
     if value is None:
@@ -183,3 +193,9 @@ def _parse_int_env(name: str, *, default: int, minimum: int = 1) -> int:
     except ValueError:
         return max(default, minimum)
     return parsed if parsed >= minimum else minimum
+
+
+DEFAULT_GRID_ID = (
+    f"{_parse_int_env('HEATMAP_COLS', default=12, minimum=1)}x"
+    f"{_parse_int_env('HEATMAP_ROWS', default=8, minimum=1)}"
+)